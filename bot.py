@@ -2,21 +2,75 @@ import os
 import json
 import re
 import asyncio
+import base64
+import functools
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+import types
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import diskcache
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
 from telegram import Update, BotCommand
 from telegram.constants import ChatAction
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import Conflict, NetworkError
+from telegram.error import Conflict, NetworkError, TelegramError
 
+import httpx
 import openai
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # semantic cache is optional
+    faiss = None
 
 # Load secrets from .env
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
+
+# Webhook settings. PUBLIC_HOST is the HTTPS host in front of the bot
+# (nginx/Caddy terminating TLS); leave it unset to fall back to polling.
+PUBLIC_HOST = os.getenv("PUBLIC_HOST")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
+# One pooled client for all OpenAI calls, so connections are kept alive.
+# Retries are done by create_completion(), not by the client.
+OPENAI_CLIENT = openai.AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=100, max_keepalive_connections=100, keepalive_expiry=600
+        )
+    )
+)
+
+# Pace requests to stay under the account's rate limits instead of hitting 429s
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "90000"))
+REQUEST_LIMITER = AsyncLimiter(OPENAI_RPM, time_period=60)
+TOKEN_LIMITER = AsyncLimiter(OPENAI_TPM, time_period=60)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
 
 # Cache for greetings
 CACHE = {
@@ -25,28 +79,383 @@ CACHE = {
     "thanks": "You're welcome! 😊",
     "thank you": "You're welcome! 😊"
 }
+CACHE = types.MappingProxyType({sys.intern(k): v for k, v in CACHE.items()})
+# Longer messages can't match any greeting, so they skip the lookup entirely
+CACHE_MAX_MESSAGE_LEN = 32
+
+# Semantic cache for paraphrased questions ("hi there" vs "Hi!")
+SEMANTIC_CACHE_FILE = "semantic_cache.jsonl"
+SEMANTIC_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.92  # minimum cosine similarity for a hit
+SEMANTIC_CACHE_SIZE = 10000  # entries kept
+SEMANTIC_CACHE_TTL = 86400  # seconds, same as DISK_CACHE_TTL
+SEMANTIC_PRUNE_INTERVAL = 3600  # seconds between expiry sweeps
+
+
+class SemanticCache:
+    """Embedding index of recent prompts and their replies.
+
+    Each entry is stored in the JSONL file with its normalized embedding, so
+    a restart doesn't re-encode anything. Entries expire after ``ttl``
+    seconds and at most ``size`` are kept; pruning rebuilds the index from
+    the stored vectors and compacts the file.
+
+    The model and index are loaded on first use. All methods block, so call
+    them through asyncio.to_thread. Only the index is guarded by the lock;
+    embedding runs outside it so concurrent lookups don't queue up.
+    """
+
+    def __init__(self, path: str, threshold: float, size: int, ttl: float):
+        self.path = path
+        self.threshold = threshold
+        self.size = size
+        self.ttl = ttl
+        self.model = None
+        self.dim = None
+        self.index = None
+        # Parallel lists in insertion (so chronological) order, row i is index id i
+        self.vectors = []
+        self.texts = []
+        self.replies = []
+        self.created = []
+        self.last_prune = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _embed(model, texts):
+        vectors = model.encode(texts, convert_to_numpy=True).astype("float32")
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    @staticmethod
+    def _line(vector, text: str, reply: str, created: float) -> str:
+        return json.dumps({
+            "text": text,
+            "reply": reply,
+            "time": created,
+            "vector": base64.b64encode(vector.tobytes()).decode("ascii")
+        }, ensure_ascii=False) + "\n"
+
+    def _read_entries(self, dim: int) -> list:
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(entry, dict) or not entry.get("reply") or not entry.get("vector"):
+                    continue
+                try:
+                    vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype="float32")
+                except (TypeError, ValueError):
+                    continue
+                if vector.shape != (dim,):
+                    continue  # written by a different model
+                entries.append((vector, entry.get("text", ""), entry["reply"], float(entry.get("time", 0))))
+        return entries
+
+    def _keep(self, entries: list, now: float) -> list:
+        entries = [e for e in entries if e[3] > now - self.ttl]
+        return entries[-self.size:]
+
+    def _rebuild(self, entries: list):
+        index = faiss.IndexFlatIP(self.dim)
+        if entries:
+            index.add(np.stack([e[0] for e in entries]))
+        vectors, texts, replies, created = (list(c) for c in zip(*entries)) if entries else ([], [], [], [])
+        self.index, self.vectors, self.texts, self.replies, self.created = index, vectors, texts, replies, created
+
+    def _rewrite(self):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for entry in zip(self.vectors, self.texts, self.replies, self.created):
+                f.write(self._line(*entry))
+        os.replace(tmp_file, self.path)
+
+    def _prune(self, now: float):
+        entries = list(zip(self.vectors, self.texts, self.replies, self.created))
+        kept = self._keep(entries, now)
+        self.last_prune = now
+        if len(kept) != len(entries):
+            self._rebuild(kept)
+            self._rewrite()
+
+    def _load(self):
+        model = SentenceTransformer(SEMANTIC_MODEL)
+        self.dim = model.get_sentence_embedding_dimension()
+        entries = self._read_entries(self.dim)
+        now = time.time()
+        kept = self._keep(entries, now)
+        self._rebuild(kept)
+        if len(kept) != len(entries):
+            self._rewrite()
+        self.last_prune = now
+        # Set last, so a failed load is retried on the next call
+        self.model = model
+
+    def _ensure_loaded(self):
+        with self.lock:
+            if self.model is None:
+                self._load()
+        return self.model
+
+    def lookup(self, text: str):
+        vector = self._embed(self._ensure_loaded(), [text])
+        now = time.time()
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vector, 1)
+            i = ids[0][0]
+            if scores[0][0] >= self.threshold and self.created[i] > now - self.ttl:
+                return self.replies[i]
+            return None
+
+    def add(self, text: str, reply: str):
+        vector = self._embed(self._ensure_loaded(), [text])
+        now = time.time()
+        with self.lock:
+            self.index.add(vector)
+            self.vectors.append(vector[0])
+            self.texts.append(text)
+            self.replies.append(reply)
+            self.created.append(now)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(self._line(vector[0], text, reply, now))
+            # Let the store overshoot by 10% so a full cache isn't rebuilt on every add
+            if len(self.replies) > self.size + self.size // 10 \
+                    or now - self.last_prune >= SEMANTIC_PRUNE_INTERVAL:
+                self._prune(now)
+
+
+SEMANTIC_CACHE = (
+    SemanticCache(SEMANTIC_CACHE_FILE, SEMANTIC_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL)
+    if faiss else None
+)
+
+# In-memory cache of recent LLM replies, behind the static CACHE
+REPLY_CACHE_SIZE = 2048
+REPLY_CACHE_TTL = 3600  # seconds
+
+
+class _LeaderCancelled(Exception):
+    """The caller running a shared request was cancelled before it finished."""
+
+
+def async_ttl_cache(maxsize: int, ttl: float):
+    """Cache a ``prompt -> reply`` coroutine by normalized prompt.
+
+    Extra arguments are passed through but are not part of the key.
+    Concurrent calls for the same prompt share one in-flight request; if the
+    caller running it is cancelled, a waiting caller takes over. Exceptions
+    are not cached.
+    """
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        pending = {}
+
+        @functools.wraps(func)
+        async def wrapper(prompt: str, *args, **kwargs) -> str:
+            key = prompt.lower().strip()
+            while True:
+                if key in cache:
+                    return cache[key]
+                shared = pending.get(key)
+                if shared is None:
+                    break
+                try:
+                    return await asyncio.shield(shared)
+                except _LeaderCancelled:
+                    continue  # retry, running the request ourselves if nobody else has
+
+            future = asyncio.get_running_loop().create_future()
+            pending[key] = future
+            try:
+                result = await func(prompt, *args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            else:
+                cache[key] = result
+                future.set_result(result)
+                return result
+            finally:
+                del pending[key]
+                if not future.done():
+                    # Cancelled: don't pass the CancelledError to other users' handlers
+                    future.set_exception(_LeaderCancelled())
+                # Consume the result so an unawaited exception isn't logged
+                future.exception()
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+# On-disk cache of LLM replies keyed by prompt hash, survives restarts
+DISK_CACHE_DIR = "llm_cache"
+DISK_CACHE_SIZE = 512 * 1024 * 1024  # bytes
+DISK_CACHE_TTL = 86400  # seconds
+DISK_CACHE = diskcache.Cache(DISK_CACHE_DIR, size_limit=DISK_CACHE_SIZE)
+
+# Opt-in: prompts arriving within BATCH_WINDOW seconds share one LLM request.
+# Off by default, since batched users share one model context (one message
+# can steer or leak into another's reply) and one output-token budget. Only
+# worth enabling when requests per minute, not tokens, is the limit.
+BATCH_PROMPTS = os.getenv("BATCH_PROMPTS", "0") == "1"
+BATCH_MAX_SIZE = 8
+BATCH_WINDOW = 0.05
+BATCH_SYSTEM_PROMPT = (
+    "You will receive a JSON array of {n} independent user messages. "
+    "Reply to each one on its own, as if it were the only message. "
+    "Respond with only a JSON array of {n} strings, where the i-th string "
+    "is your reply to the i-th message."
+)
 
 # Daily message limit
 DAILY_LIMIT = 50
-
-# User counters file
-COUNTERS_FILE = "user_counters.json"
-if os.path.exists(COUNTERS_FILE):
-    with open(COUNTERS_FILE, "r", encoding="utf-8") as f:
-        USER_COUNTERS = json.load(f)
-        for u in USER_COUNTERS:
-            USER_COUNTERS[u]["reset_time"] = datetime.fromisoformat(USER_COUNTERS[u]["reset_time"])
-else:
-    USER_COUNTERS = {}
-
-# Users in translation mode
-TRANSLATE_MODE_USERS = set()
+RESET_PERIOD = 86400  # seconds
+
+# User counters, stored in SQLite (WAL mode)
+COUNTERS_DB = "counters.db"
+# JSON files used before the SQLite store, imported once on first start
+LEGACY_COUNTERS_FILE = "user_counters.json"
+LEGACY_COUNTERS_LOG = "user_counters.log"
+
+
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_OFFSET_BUCKET = 900  # seconds; DST transitions fall on quarter hours
+
+
+def parse_iso_timestamps(values: list) -> np.ndarray:
+    """Convert naive local ISO timestamps to epoch seconds.
+
+    numpy parses the strings in one vectorized pass as wall-clock seconds.
+    The UTC offset only changes at DST transitions, so it is worked out once
+    per 15-minute bucket rather than per entry, and added back with one
+    array operation.
+    """
+    wall = np.array(values, dtype="datetime64[us]").astype("datetime64[s]").view(np.int64)
+    buckets, inverse = np.unique(wall // _OFFSET_BUCKET, return_inverse=True)
+    offsets = np.array([
+        int((_EPOCH_NAIVE + timedelta(seconds=k * _OFFSET_BUCKET)).timestamp()) - k * _OFFSET_BUCKET
+        for k in buckets.tolist()
+    ], dtype=np.int64)
+    return wall + offsets[inverse]
+
+
+def load_legacy_counters() -> dict:
+    counters = {}
+    if os.path.exists(LEGACY_COUNTERS_FILE):
+        with open(LEGACY_COUNTERS_FILE, "rb") as f:
+            counters = orjson.loads(f.read())
+        for data in counters.values():
+            if "reset" not in data:
+                data["reset"] = data.pop("reset_time")
+    # Replay updates written since the last snapshot (last one wins)
+    if os.path.exists(LEGACY_COUNTERS_LOG):
+        with open(LEGACY_COUNTERS_LOG, "rb") as f:
+            for line in f:
+                try:
+                    delta = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # torn line from a crash mid-write
+                counters[delta["uid"]] = {"count": delta["count"], "reset": delta["reset"]}
+
+    # Files written before the switch to epoch seconds hold ISO timestamps
+    iso = [data for data in counters.values() if isinstance(data["reset"], str)]
+    if iso:
+        resets = parse_iso_timestamps([data["reset"] for data in iso])
+        for data, reset in zip(iso, resets.tolist()):
+            data["reset"] = reset
+    return counters
+
+
+def open_counters_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS users ("
+        "uid TEXT PRIMARY KEY, count INTEGER NOT NULL, reset INTEGER NOT NULL)"
+    )
+    if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+        legacy = load_legacy_counters()
+        if legacy:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO users (uid, count, reset) VALUES (?, ?, ?)",
+                    ((u, d["count"], d["reset"]) for u, d in legacy.items())
+                )
+            print(f"✅ Imported {len(legacy)} user counters into {path}")
+    return conn
+
+
+class CounterTable:
+    """Daily message counters as parallel numpy arrays.
+
+    ``index`` maps a user id to its row in ``counts`` and ``resets``.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.index = {}
+        self.counts = np.zeros(capacity, dtype=np.int32)
+        self.resets = np.zeros(capacity, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows: list) -> "CounterTable":
+        table = cls(max(1024, 2 * len(rows)))
+        if rows:
+            uids, counts, resets = zip(*rows)
+            table.index = dict(zip(uids, range(len(uids))))
+            table.counts[:len(uids)] = counts
+            table.resets[:len(uids)] = resets
+        return table
+
+    def add(self, user_id: str, count: int, reset: int) -> int:
+        row = len(self.index)
+        if row == len(self.counts):
+            self.counts = np.resize(self.counts, 2 * row)
+            self.resets = np.resize(self.resets, 2 * row)
+        self.index[user_id] = row
+        self.counts[row] = count
+        self.resets[row] = reset
+        return row
+
+
+def load_counter_table(conn: sqlite3.Connection) -> CounterTable:
+    with COUNTERS_LOCK:
+        rows = conn.execute("SELECT uid, count, reset FROM users").fetchall()
+    return CounterTable.from_rows(rows)
+
+
+# Opened in post_init, off the event loop. SQLite is the durable copy and
+# USER_COUNTERS the in-memory one every message is checked against. Writes
+# run in order on COUNTERS_EXECUTOR's single thread.
+COUNTERS_CONN = None
+COUNTERS_LOCK = threading.Lock()
+COUNTERS_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="counters")
+USER_COUNTERS = CounterTable()
+
+# Seconds between typing indicator refreshes (Telegram shows it for ~5s).
+# One heartbeat task per chat, shared by all handlers waiting on a reply.
+TYPING_INTERVAL = 4
+_typing_refs = {}
+_typing_tasks = {}
+
+# Per-user handler locks, dropped once no handler holds or waits on them
+_user_locks = weakref.WeakValueDictionary()
+
+
+# Markdown bold markers and HTML tags, stripped in a single pass
+_STRIP_RE = re.compile(r"\*\*|<[^>]+>")
 
 
 def clean_response(text: str) -> str:
-    text = text.replace("**", "")
-    text = re.sub(r"<[^>]+>", "", text)
-    return text.strip()
+    return _STRIP_RE.sub("", text).strip()
 
 
 async def set_bot_commands(application: Application):
@@ -74,6 +483,25 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+def serialized_per_user(handler):
+    """Run a handler under a per-user lock.
+
+    With concurrent updates, messages from different users are handled in
+    parallel, but one user's messages still run one at a time so the
+    check -> reply -> increment sequence on their counter can't interleave.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = str(update.effective_user.id)
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = asyncio.Lock()
+        async with lock:
+            return await handler(update, context)
+    return wrapper
+
+
+@serialized_per_user
 async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     if not check_user_limit(user_id):
@@ -81,49 +509,250 @@ async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"⚠️ You have reached your daily limit of {DAILY_LIMIT} messages. Please try again tomorrow."
         )
         return
-    TRANSLATE_MODE_USERS.add(user_id)
+    # The next message from this user is translated
+    context.user_data["translate"] = True
     await update.message.reply_text("🌐 Send me the text you want to translate (English ↔ Khmer):")
 
 
-def check_user_limit(user_id: str) -> bool:
-    now = datetime.now()
-    user_data = USER_COUNTERS.get(user_id)
-    if user_data:
-        if now >= user_data["reset_time"]:
-            USER_COUNTERS[user_id] = {"count": 0, "reset_time": now + timedelta(days=1)}
-            return True
-        elif user_data["count"] >= DAILY_LIMIT:
-            return False
-        else:
-            return True
+def _save_counter(user_id: str, count: int, reset: int):
+    try:
+        with COUNTERS_LOCK:
+            COUNTERS_CONN.execute(
+                "INSERT INTO users (uid, count, reset) VALUES (?, ?, ?) "
+                "ON CONFLICT(uid) DO UPDATE SET count = excluded.count, reset = excluded.reset",
+                (user_id, count, reset)
+            )
+    except sqlite3.Error as e:
+        print("❌ Counter store error:", e)
+
+
+def save_counter(user_id: str, row: int):
+    asyncio.get_running_loop().run_in_executor(
+        COUNTERS_EXECUTOR, _save_counter,
+        user_id, int(USER_COUNTERS.counts[row]), int(USER_COUNTERS.resets[row])
+    )
+
+
+def _start_new_day(user_id: str, row, now: int) -> bool:
+    reset = now + RESET_PERIOD
+    if row is None:
+        row = USER_COUNTERS.add(user_id, 0, reset)
     else:
-        USER_COUNTERS[user_id] = {"count": 0, "reset_time": now + timedelta(days=1)}
-        return True
+        USER_COUNTERS.counts[row] = 0
+        USER_COUNTERS.resets[row] = reset
+    save_counter(user_id, row)
+    return True
+
+
+def check_user_limit(user_id: str) -> bool:
+    # Fast path: a known user within their day is one lookup and two int
+    # compares. .item() returns Python ints, which compare much faster than
+    # numpy scalars.
+    row = USER_COUNTERS.index.get(user_id)
+    now = int(time.time())
+    if row is None or now >= USER_COUNTERS.resets.item(row):
+        return _start_new_day(user_id, row, now)
+    return USER_COUNTERS.counts.item(row) < DAILY_LIMIT
+
+
+def increment_counter(user_id: str):
+    row = USER_COUNTERS.index[user_id]
+    USER_COUNTERS.counts[row] += 1
+    save_counter(user_id, row)
+
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    reraise=True
+)
+async def create_completion(messages: list) -> str:
+    # Rough estimate of ~4 characters per token
+    tokens = sum(len(m["content"]) for m in messages) // 4
+    async with REQUEST_LIMITER:
+        await TOKEN_LIMITER.acquire(min(max(tokens, 1), OPENAI_TPM))
+        response = await OPENAI_CLIENT.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages
+        )
+    return response.choices[0].message.content
+
+
+async def request_chatgpt_reply(user_message: str) -> str:
+    content = await create_completion([{"role": "user", "content": user_message}])
+    return clean_response(content)
 
 
-def save_counters():
-    data = {}
-    for u in USER_COUNTERS:
-        data[u] = {
-            "count": USER_COUNTERS[u]["count"],
-            "reset_time": USER_COUNTERS[u]["reset_time"].isoformat()
-        }
-    with open(COUNTERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+async def request_chatgpt_replies(prompts: list) -> list:
+    """Answer several independent prompts with a single completion.
 
+    If the batch fails, each prompt is asked separately and its reply or
+    exception is returned in its own slot, so one bad prompt doesn't fail
+    the others.
+    """
+    if len(prompts) == 1:
+        return [await request_chatgpt_reply(prompts[0])]
 
-async def fetch_chatgpt_reply(user_message: str) -> str:
     try:
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": user_message}]
+        content = await create_completion([
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT.format(n=len(prompts))},
+            {"role": "user", "content": json.dumps(prompts, ensure_ascii=False)}
+        ])
+        replies = json.loads(content)
+    except Exception as e:
+        print("⚠️ Batched request failed, retrying prompts one by one:", e)
+        replies = None
+    else:
+        if not isinstance(replies, list) or len(replies) != len(prompts) \
+                or not all(isinstance(r, str) for r in replies):
+            print("⚠️ Batched reply was malformed, retrying prompts one by one")
+            replies = None
+    if replies is None:
+        return await asyncio.gather(
+            *(request_chatgpt_reply(p) for p in prompts), return_exceptions=True
         )
-        return clean_response(response.choices[0].message.content)
+    return [clean_response(r) for r in replies]
+
+
+class PromptBatcher:
+    """Coalesce prompts that arrive within a short window into one request.
+
+    ``fetch_batch`` takes a list of prompts and returns the replies in the
+    same order; an exception in a slot fails only that prompt.
+    """
+
+    def __init__(self, fetch_batch, max_size: int, window: float):
+        self.fetch_batch = fetch_batch
+        self.max_size = max_size
+        self.window = window
+        self.queue = None
+        self.task = None
+        self.in_flight = set()
+
+    async def submit(self, prompt: str) -> str:
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next batch can start filling
+            task = asyncio.create_task(self._dispatch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _dispatch(self, batch: list):
+        try:
+            replies = await self.fetch_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), reply in zip(batch, replies):
+            if future.done():
+                continue
+            if isinstance(reply, Exception):
+                future.set_exception(reply)
+            else:
+                future.set_result(reply)
+
+
+PROMPT_BATCHER = PromptBatcher(request_chatgpt_replies, max_size=BATCH_MAX_SIZE, window=BATCH_WINDOW)
+
+
+def prompt_hash(prompt: str) -> str:
+    # Not for security, blake2b is just fast on short strings
+    return hashlib.blake2b(prompt.lower().strip().encode(), digest_size=16).hexdigest()
+
+
+async def semantic_lookup(prompt: str):
+    try:
+        return await asyncio.to_thread(SEMANTIC_CACHE.lookup, prompt)
+    except Exception as e:
+        print("⚠️ Semantic cache error:", e)
+        return None
+
+
+async def semantic_add(prompt: str, reply: str):
+    try:
+        await asyncio.to_thread(SEMANTIC_CACHE.add, prompt, reply)
+    except Exception as e:
+        print("⚠️ Semantic cache error:", e)
+
+
+@async_ttl_cache(maxsize=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL)
+async def fetch_chatgpt_reply(user_message: str, use_semantic_cache: bool = True) -> str:
+    # Exact-match layers first (memory, then disk); embeddings only on a miss
+    key = prompt_hash(user_message)
+    reply = await asyncio.to_thread(DISK_CACHE.get, key)
+    if reply is not None:
+        return reply
+
+    use_semantic_cache = use_semantic_cache and SEMANTIC_CACHE is not None
+    if use_semantic_cache:
+        reply = await semantic_lookup(user_message)
+    if reply is None:
+        if BATCH_PROMPTS:
+            reply = await PROMPT_BATCHER.submit(user_message)
+        else:
+            reply = await request_chatgpt_reply(user_message)
+        if use_semantic_cache:
+            await semantic_add(user_message, reply)
+    await asyncio.to_thread(DISK_CACHE.set, key, reply, expire=DISK_CACHE_TTL)
+    return reply
+
+
+async def get_reply(prompt: str, use_semantic_cache: bool = True) -> str:
+    try:
+        return await fetch_chatgpt_reply(prompt, use_semantic_cache=use_semantic_cache)
     except Exception as e:
         print("❌ OpenAI Error:", e)
         return "⚠️ Sorry, I'm busy right now. Try again later."
 
 
+async def send_typing(bot, chat_id: int):
+    try:
+        await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+    except TelegramError as e:
+        print("⚠️ Typing indicator failed:", e)
+
+
+async def _typing_heartbeat(bot, chat_id: int):
+    while _typing_refs.get(chat_id):
+        await send_typing(bot, chat_id)
+        await asyncio.sleep(TYPING_INTERVAL)
+
+
+def start_typing(bot, chat_id: int):
+    _typing_refs[chat_id] = _typing_refs.get(chat_id, 0) + 1
+    if _typing_refs[chat_id] == 1:
+        _typing_tasks[chat_id] = asyncio.create_task(_typing_heartbeat(bot, chat_id))
+
+
+def stop_typing(chat_id: int):
+    _typing_refs[chat_id] -= 1
+    if _typing_refs[chat_id] == 0:
+        del _typing_refs[chat_id]
+        _typing_tasks.pop(chat_id).cancel()
+
+
+@serialized_per_user
 async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
     user_message = update.message.text
@@ -134,31 +763,26 @@ async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    is_translate_mode = user_id in TRANSLATE_MODE_USERS
-
-    # Typing indicator
-    async def send_typing():
-        while True:
-            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-            await asyncio.sleep(2)
-
-    typing_task = asyncio.create_task(send_typing())
+    is_translate_mode = context.user_data.pop("translate", False)
 
     # Check cache
-    key = user_message.lower().strip()
-    if key in CACHE and not is_translate_mode:
-        reply = CACHE[key]
-    else:
+    reply = None
+    if not is_translate_mode and len(user_message) < CACHE_MAX_MESSAGE_LEN:
+        reply = CACHE.get(sys.intern(user_message.lower().strip()))
+    if reply is None:
         prompt = user_message
         if is_translate_mode:
             prompt = f"Translate this text to Khmer and English: {user_message}"
-        reply = await fetch_chatgpt_reply(prompt)
-        if is_translate_mode:
-            TRANSLATE_MODE_USERS.remove(user_id)
 
-    typing_task.cancel()
-    USER_COUNTERS[user_id]["count"] += 1
-    save_counters()
+        chat_id = update.effective_chat.id
+        start_typing(context.bot, chat_id)
+        try:
+            # Translations should follow the exact text, so skip the semantic cache
+            reply = await get_reply(prompt, use_semantic_cache=not is_translate_mode)
+        finally:
+            stop_typing(chat_id)
+
+    increment_counter(user_id)
 
     await update.message.reply_text(reply)
 
@@ -172,14 +796,44 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         print("⚠️ Network error occurred.")
 
 
+async def warm_up_openai():
+    # Open the TLS connection now so the first user message doesn't pay for it.
+    # Listing models costs no tokens.
+    try:
+        await OPENAI_CLIENT.models.list()
+    except Exception as e:
+        print("⚠️ OpenAI warm-up failed:", e)
+
+
 async def post_init(application: Application):
     """Function to run after the application is initialized"""
-    await set_bot_commands(application)
+    global COUNTERS_CONN, USER_COUNTERS
+    COUNTERS_CONN = await asyncio.to_thread(open_counters_db, COUNTERS_DB)
+    USER_COUNTERS = await asyncio.to_thread(load_counter_table, COUNTERS_CONN)
+    await asyncio.gather(set_bot_commands(application), warm_up_openai())
     print("✅ Bot is running...")
 
 
+async def post_shutdown(application: Application):
+    """Close the OpenAI client and local stores on shutdown"""
+    await OPENAI_CLIENT.close()
+    DISK_CACHE.close()
+    if COUNTERS_CONN:
+        # Let queued counter writes finish first
+        await asyncio.to_thread(COUNTERS_EXECUTOR.shutdown)
+        with COUNTERS_LOCK:
+            COUNTERS_CONN.close()
+
+
 def main():
-    app = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Add handlers
     app.add_handler(CommandHandler("start", start))
@@ -190,9 +844,17 @@ def main():
     # Add error handler
     app.add_error_handler(error_handler)
 
-    # Start polling (PTB manages the event loop internally)
+    # Start webhook or polling (PTB manages the event loop internally)
     try:
-        app.run_polling()
+        if PUBLIC_HOST:
+            app.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=TELEGRAM_TOKEN,
+                webhook_url=f"https://{PUBLIC_HOST}/{TELEGRAM_TOKEN}"
+            )
+        else:
+            app.run_polling()
     except Conflict:
         print("❌ Another bot instance is already running with the same token!")
         print("💡 Please check for other running Python processes and stop them.")